@@ -6,10 +6,35 @@
 # The markdown code snippets in this section all get put together to define a class at the end of the section, which describes our battery system. 
 # This model of the system will be useful to simulate battery operation, stepping through time at a daily increment.
 
+import os
 import time
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pandas as pd
 import pulp
+import scipy.sparse
+from scipy.optimize import linprog
+
+try:
+    from numba import config as numba_config
+    from numba import get_num_threads, njit, prange, set_num_threads
+except ImportError:
+    # Numba is optional: without it the compiled functions below run as plain Python, in a single thread
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda function: function
+
+    prange = range
+
+    def get_num_threads():
+        return 1
+
+    def set_num_threads(n):
+        pass
+
+    class numba_config:
+        NUMBA_NUM_THREADS = 1
 
 
 # Putting all these methods together to define the `Battery` class, we are ready to ingest the data and proceed to simulating battery operation.
@@ -25,30 +50,52 @@ class Battery():
     ):
         # Set up decision variables for optimization.
         # These are the hourly charge and discharge flows for the optimization horizon, with their limitations.
+        # They are kept in lists indexed by the hour of the horizon.
         
         self.time_horizon = time_horizon
 
-        self.charge = pulp.LpVariable.dicts(
-            "charging_power",
-            (f'c_t_{i}' for i in range(0, time_horizon)),
-            lowBound=0,
-            upBound=max_charge_power_capacity,
-            cat='Continuous',
-        )
+        self.charge = [
+            pulp.LpVariable(
+                'charging_power_c_t_%d' % i,
+                lowBound=0,
+                upBound=max_charge_power_capacity,
+                cat='Continuous',
+            )
+            for i in range(0, time_horizon)
+        ]
+
+        self.discharge = [
+            pulp.LpVariable(
+                'discharging_power_d_t_%d' % i,
+                lowBound=0,
+                upBound=max_discharge_power_capacity,
+                cat='Continuous',
+            )
+            for i in range(0, time_horizon)
+        ]
 
-        self.discharge = pulp.LpVariable.dicts(
-            "discharging_power",
-            (f'd_t_{i}' for i in range(0, time_horizon)),
-            lowBound=0,
-            upBound=max_discharge_power_capacity,
-            cat='Continuous',
-        )
+        # State of energy at the end of each hour of the horizon.
+        # Its bounds are the storage limits, which are set together with the storage constraints.
+
+        self.soc = [
+            pulp.LpVariable('state_of_energy_s_%d' % i, cat='Continuous')
+            for i in range(0, time_horizon)
+        ]
 
         # Instantiate linear programming model to maximize the objective
         self.model = pulp.LpProblem("Energy arbitrage", pulp.LpMaximize)
 
+        # The model is built once and solved again every day, so the solver is kept between days.
+        # HiGHS is used through its Python interface (highspy) when it is installed, as it solves in-process without writing files.
+        # Otherwise the CBC solver bundled with PuLP is used, and warm start lets each solve begin from the solution of the previous day.
+        highs = pulp.HiGHS(msg=False, threads=1)
+        if highs.available():
+            self.solver = highs
+        else:
+            self.solver = pulp.PULP_CBC_CMD(msg=0, warmStart=True)
+
     def set_objective(self, prices):
-        # Create a model and objective function.
+        # Create or replace the objective function of the model.
         # This uses price data, which must have one price for each point in the time horizon.
         
         try:
@@ -58,20 +105,13 @@ class Battery():
 
         # Objective is profit
         # This formula gives the daily profit from charging/discharging activities. Charging is a cost, discharging is a revenue
-        
-        self.model += (
-                pulp.LpAffineExpression(
-                    [
-                        (self.charge[f'c_t_{i}'], -1 * prices[i])
-                        for i in range(0, self.time_horizon)
-                    ]
-                )
-                +
+        # The expression is built in one go, pairing each variable with the price of its hour
+
+        prices = np.asarray(prices, dtype=np.float64)
+        self.model.setObjective(
                 pulp.LpAffineExpression(
-                    [
-                        (self.discharge[f'd_t_{i}'], prices[i])
-                        for i in range(0, self.time_horizon)
-                    ]
+                    list(zip(self.charge, (-prices).tolist()))
+                    + list(zip(self.discharge, prices.tolist()))
                 )
         )
 
@@ -83,53 +123,35 @@ class Battery():
             discharge_efficiency,
             initial_level,
     ):
-        # Storage level constraint 1
-        # This says the battery cannot have less than zero energy, at any hour in the horizon
+        # Storage level constraints
+        # The state of energy of each hour is the one of the previous hour plus the charged energy minus the discharged energy.
         # Note this is a place where round-trip efficiency is factored in.
         # The energy available for discharge is the round-trip efficiency times the energy that was charged.
-        
-        for hour_of_sim in range(1, self.time_horizon + 1):
-            self.model += (
-                    initial_level
-                    +
-                    pulp.LpAffineExpression(
-                        [
-                            (self.charge[f'c_t_{i}'], efficiency)
-                            for i in range(0, hour_of_sim)
-                        ]
-                    )
-                    -
-                    pulp.LpAffineExpression(
-                        [
-                            (self.discharge[f'd_t_{i}'], discharge_efficiency)
-                            for i in range(0, hour_of_sim)
-                        ]
-                    ) >= min_capacity
-            )
+        # The battery cannot have less than the minimum capacity, nor more than the discharge energy capacity: these are the bounds of the state of energy.
+        # These constraints are added once; only the initial level changes from one day to the next (see update_initial_level).
+
+        for i in range(0, self.time_horizon):
+            self.soc[i].lowBound = min_capacity
+            self.soc[i].upBound = discharge_energy_capacity
 
-        # Storage level constraint 2
-        # Similar to 1
-        # This says the battery cannot have more than the discharge energy capacity
-    
-        for hour_of_sim in range(1, self.time_horizon + 1):
+            previous_level = initial_level if i == 0 else self.soc[i - 1]
             self.model += (
-                    initial_level
-                    +
-                    pulp.LpAffineExpression(
-                        [
-                            (self.charge[f'c_t_{i}'], efficiency)
-                            for i in range(0, hour_of_sim)
-                        ]
-                    )
-                    -
-                    pulp.LpAffineExpression(
-                        [
-                            (self.discharge[f'd_t_{i}'], discharge_efficiency)
-                            for i in range(0, hour_of_sim)
-                        ]
-                    ) <= discharge_energy_capacity
+                    self.soc[i]
+                    == previous_level
+                    + efficiency * self.charge[i]
+                    - discharge_efficiency * self.discharge[i],
+                    f'storage_level_{i}',
             )
 
+        # The initial level only appears in the storage constraint of the first hour, which is kept to update it every day
+        self.initial_level_constraint = self.model.constraints['storage_level_0']
+
+    def update_initial_level(self, initial_level):
+        # Only the right hand side of the storage constraints changes from one day to the next.
+        # The constraint keeps every term on the left hand side, so its constant is the negative initial level.
+
+        self.initial_level_constraint.constant = -initial_level
+
     def add_throughput_constraints(
             self,
             max_daily_discharged_throughput,
@@ -138,14 +160,11 @@ class Battery():
         # The sum of all discharge flow within a day cannot exceed this
         # Assumes the time horizon is at least 24 hours
 
-        self.model += pulp.lpSum(
-            self.discharge[f'd_t_{i}']
-            for i in range(0, self.time_horizon)
-        ) <= max_daily_discharged_throughput
+        self.model += pulp.lpSum(self.discharge) <= max_daily_discharged_throughput
 
     def solve_model(self):
         # Solve the optimization problem
-        self.model.solve()
+        self.model.solve(self.solver)
 
         # Show a warning if an optimal solution was not found
         if pulp.LpStatus[self.model.status] != 'Optimal':
@@ -154,22 +173,394 @@ class Battery():
     def collect_output(self):
         # Collect hourly charging and discharging rates within the time horizon
         
-        hourly_charges = np.array(
-            [
-                self.charge[f'c_t_{i}'].varValue
-                for i in range(0, 24)
-            ]
+        hourly_charges = np.fromiter(
+            (v.varValue for v in self.charge),
+            dtype=np.float64,
+            count=self.time_horizon,
         )
-        hourly_discharges = np.array(
-            [
-                self.discharge[f'd_t_{i}'].varValue
-                for i in range(0, 24)
-            ]
+        hourly_discharges = np.fromiter(
+            (v.varValue for v in self.discharge),
+            dtype=np.float64,
+            count=self.time_horizon,
         )
 
         return hourly_charges, hourly_discharges
 
 
+# # Linear programming model as sparse matrices
+# The same model as the `Battery` class, written directly in the matrix form used by `scipy.optimize.linprog`.
+# The decision variables are stacked as [charges, discharges, states of energy], one of each for every hour of the time horizon.
+# The matrices only depend on the battery, so they are built once for the whole simulation.
+# Every day only the objective (prices) and the first element of `b_eq` (initial level) change.
+#
+# - `A_eq`, `b_eq`, the storage constraints: state of energy - previous state of energy - efficiency * charge + discharge_efficiency * discharge = 0 (initial level for the first hour)
+# - `A_ub`, `b_ub`, the maximum discharge throughput constraint
+# - `bounds`, the power limits of charges and discharges, and the storage limits of the state of energy
+
+
+def build_lp(
+        time_horizon,
+        max_discharge_power_capacity,
+        max_charge_power_capacity,
+        discharge_energy_capacity,
+        efficiency,
+        discharge_efficiency,
+        max_daily_discharged_throughput,
+        min_capacity,
+):
+    identity = scipy.sparse.identity(time_horizon, format='csr')
+    previous_hour = scipy.sparse.eye(time_horizon, k=-1, format='csr')
+
+    A_eq = scipy.sparse.hstack(
+        [
+            -efficiency * identity,
+            discharge_efficiency * identity,
+            identity - previous_hour,
+        ],
+        format='csr',
+    )
+    b_eq = np.zeros(time_horizon)
+
+    A_ub = scipy.sparse.hstack(
+        [
+            scipy.sparse.csr_matrix((1, time_horizon)),
+            scipy.sparse.csr_matrix(np.ones((1, time_horizon))),
+            scipy.sparse.csr_matrix((1, time_horizon)),
+        ],
+        format='csr',
+    )
+    b_ub = np.array([max_daily_discharged_throughput])
+
+    bounds = (
+        [(0, max_charge_power_capacity)] * time_horizon
+        + [(0, max_discharge_power_capacity)] * time_horizon
+        + [(min_capacity, discharge_energy_capacity)] * time_horizon
+    )
+
+    return A_ub, b_ub, A_eq, b_eq, bounds
+
+
+# # Merit-order dispatch
+# A faster heuristic alternative to the linear programming model for one day of operation.
+# It does NOT find the linear programming optimum in general, and its profit is often lower even when the storage limits never bind.
+# For example, with prices [8, 57, 34, 71], efficiencies of 1, 10 MW and no storage or throughput limit, it takes the widest spread first (8 -> 71) and gets 630,
+# while the optimum charges at 8 and 34 and discharges at 57 and 71 for 860.
+# The energy already stored is discharged in the most expensive hours first.
+# Then the most profitable pairs of hours are taken one by one: charge in the cheaper hour and discharge the same energy in the later, more expensive hour.
+# Finally, the battery charges in any hour with negative prices if there is room left.
+# Every step respects the power, throughput and storage limits, so the result is always a feasible operation, but only a lower bound of the optimal profit.
+# It sorts all T * (T - 1) / 2 pairs of hours and checks up to T hours for each of them, so it takes O(T^3) time for a horizon of T hours.
+
+
+@njit(cache=True)
+def solve_day(
+        prices,
+        initial_level,
+        max_charge_power_capacity,
+        max_discharge_power_capacity,
+        efficiency,
+        discharge_efficiency,
+        discharge_energy_capacity,
+        min_capacity,
+        max_daily_discharged_throughput,
+):
+    time_horizon = prices.shape[0]
+
+    hourly_charges = np.zeros(time_horizon)
+    hourly_discharges = np.zeros(time_horizon)
+    # State of energy at the end of each hour
+    state_of_energy = np.full(time_horizon, initial_level)
+    throughput_left = max_daily_discharged_throughput
+
+    # Discharge the stored energy in the most expensive hours.
+    # The state of energy drops from the hour of the discharge onwards, so it must stay above the minimum until the end.
+
+    by_price = np.argsort(-prices, kind='mergesort')
+    for k in range(time_horizon):
+        j = by_price[k]
+        if prices[j] <= 0. or throughput_left <= 0.:
+            break
+
+        available = state_of_energy[j] - min_capacity
+        for t in range(j + 1, time_horizon):
+            available = min(available, state_of_energy[t] - min_capacity)
+
+        amount = min(
+            max_discharge_power_capacity - hourly_discharges[j],
+            throughput_left,
+            available / discharge_efficiency,
+        )
+        if amount > 0.:
+            hourly_discharges[j] += amount
+            throughput_left -= amount
+            for t in range(j, time_horizon):
+                state_of_energy[t] -= amount * discharge_efficiency
+
+    # Charge in hour i and discharge in a later hour j.
+    # Each MWh discharged needs discharge_efficiency / efficiency MWh charged, and raises the state of energy between both hours.
+
+    charge_per_discharge = discharge_efficiency / efficiency
+    n_pairs = time_horizon * (time_horizon - 1) // 2
+    charge_hours = np.empty(n_pairs, dtype=np.int64)
+    discharge_hours = np.empty(n_pairs, dtype=np.int64)
+    spreads = np.empty(n_pairs)
+
+    k = 0
+    for i in range(time_horizon):
+        for j in range(i + 1, time_horizon):
+            charge_hours[k] = i
+            discharge_hours[k] = j
+            spreads[k] = prices[j] - prices[i] * charge_per_discharge
+            k += 1
+
+    for k in np.argsort(-spreads, kind='mergesort'):
+        if spreads[k] <= 0. or throughput_left <= 0.:
+            break
+        i = charge_hours[k]
+        j = discharge_hours[k]
+
+        room = discharge_energy_capacity - state_of_energy[i]
+        for t in range(i + 1, j):
+            room = min(room, discharge_energy_capacity - state_of_energy[t])
+
+        amount = min(
+            max_discharge_power_capacity - hourly_discharges[j],
+            throughput_left,
+            (max_charge_power_capacity - hourly_charges[i]) / charge_per_discharge,
+            room / discharge_efficiency,
+        )
+        if amount > 0.:
+            hourly_charges[i] += amount * charge_per_discharge
+            hourly_discharges[j] += amount
+            throughput_left -= amount
+            for t in range(i, j):
+                state_of_energy[t] += amount * discharge_efficiency
+
+    # With negative prices charging is a revenue by itself, even if the energy is not discharged afterwards
+
+    for i in range(time_horizon):
+        if prices[i] >= 0.:
+            continue
+
+        room = discharge_energy_capacity - state_of_energy[i]
+        for t in range(i + 1, time_horizon):
+            room = min(room, discharge_energy_capacity - state_of_energy[t])
+
+        amount = min(max_charge_power_capacity - hourly_charges[i], room / efficiency)
+        if amount > 0.:
+            hourly_charges[i] += amount
+            for t in range(i, time_horizon):
+                state_of_energy[t] += amount * efficiency
+
+    return hourly_charges, hourly_discharges
+
+
+# # Daily output
+# The charging and discharging of one day are written into the output arrays of the whole simulation, starting at `offset`.
+# The state of energy is accumulated in the same pass, so no temporary arrays are needed.
+# The accumulation is done in double precision even if the output arrays are single precision, so the initial level of the next day does not drift.
+# Tanto la carga como la descarga han de tener en cuenta el rendimiento, debido a que no toda la energía estará disponible.
+# It returns the state of energy at the end of the day, which is the initial level of the next one, and the discharged throughput of the day.
+
+
+@njit(cache=True)
+def postprocess(
+        hourly_charges,
+        hourly_discharges,
+        efficiency,
+        discharge_efficiency,
+        initial_level,
+        all_hourly_state_of_energy,
+        all_hourly_charges,
+        all_hourly_discharges,
+        offset,
+):
+    state_of_energy = initial_level
+    daily_discharge_throughput = 0.
+
+    for i in range(hourly_charges.shape[0]):
+        all_hourly_charges[offset + i] = hourly_charges[i]
+        all_hourly_discharges[offset + i] = hourly_discharges[i]
+        # State of energy during the next time step (t2)
+        state_of_energy += hourly_charges[i] * efficiency - hourly_discharges[i] * discharge_efficiency
+        all_hourly_state_of_energy[offset + i] = state_of_energy
+        daily_discharge_throughput += hourly_discharges[i]
+
+    return state_of_energy, daily_discharge_throughput
+
+
+# # Daily solvers
+# `day_solver` prepares one of the solvers for the whole simulation and returns a function that solves one day from its prices and initial level.
+# It returns the hourly charges and discharges of the whole time horizon.
+#
+# - `'linprog'`, the linear programming model as sparse matrices (`build_lp`) solved with the dual simplex of HiGHS in `scipy.optimize.linprog`
+# - `'pulp'`, the linear programming model of the `Battery` class
+# - `'greedy'`, the merit-order dispatch (`solve_day`), a faster but suboptimal heuristic
+
+
+def day_solver(
+        solver,
+        time_horizon,
+        max_discharge_power_capacity,
+        max_charge_power_capacity,
+        discharge_energy_capacity,
+        efficiency,
+        discharge_efficiency,
+        max_daily_discharged_throughput,
+        min_capacity,
+):
+    if solver == 'linprog':
+        # Build the constraint matrices once, only the objective and the initial level change every day
+        A_ub, b_ub, A_eq, b_eq, bounds = build_lp(
+            time_horizon=time_horizon,
+            max_discharge_power_capacity=max_discharge_power_capacity,
+            max_charge_power_capacity=max_charge_power_capacity,
+            discharge_energy_capacity=discharge_energy_capacity,
+            efficiency=efficiency,
+            discharge_efficiency=discharge_efficiency,
+            max_daily_discharged_throughput=max_daily_discharged_throughput,
+            min_capacity=min_capacity,
+        )
+        # linprog minimizes, so the objective is the daily cost: charging is a cost, discharging is a revenue
+        objective = np.zeros(3 * time_horizon)
+
+        def solve(prices, initial_level):
+            # Update the objective and the initial level of the model
+            objective[:time_horizon] = prices
+            objective[time_horizon:2 * time_horizon] = -prices
+            b_eq[0] = initial_level
+
+            # Solve the optimization problem and collect output
+            result = linprog(
+                objective,
+                A_ub=A_ub,
+                b_ub=b_ub,
+                A_eq=A_eq,
+                b_eq=b_eq,
+                bounds=bounds,
+                method='highs-ds',
+                options={'presolve': False, 'primal_feasibility_tolerance': 1e-7},
+            )
+
+            # Without an optimal solution there is no operation to collect for the day (for instance, an initial level that cannot be brought within the storage limits)
+            if result.status != 0:
+                raise ValueError(
+                    'Error: linprog could not solve the day with initial level {} MWh: {}'.format(initial_level, result.message)
+                )
+
+            # Without presolve HiGHS can return values slightly outside the bounds (such as -1e-14 or -0.0), so they are clipped to the power limits
+            hourly_charges = np.minimum(np.maximum(result.x[:time_horizon], 0.), max_charge_power_capacity)
+            hourly_discharges = np.minimum(np.maximum(result.x[time_horizon:2 * time_horizon], 0.), max_discharge_power_capacity)
+
+            return hourly_charges, hourly_discharges
+
+    elif solver == 'pulp':
+        # Set up decision variables for optimization by instantiating the Battery class
+        battery = Battery(
+            time_horizon=time_horizon,
+            max_discharge_power_capacity=max_discharge_power_capacity,
+            max_charge_power_capacity=max_charge_power_capacity,
+        )
+
+        # The constraints do not depend on the day, so they are added only once.
+        # Every day only the objective (prices) and the initial level are updated.
+
+        # Set storage constraints
+        battery.add_storage_constraints(
+            efficiency=efficiency,
+            min_capacity=min_capacity,
+            discharge_energy_capacity=discharge_energy_capacity,
+            discharge_efficiency=discharge_efficiency,
+            initial_level=min_capacity,
+        )
+
+        # Set maximum discharge throughput constraint
+        battery.add_throughput_constraints(max_daily_discharged_throughput)
+
+        def solve(prices, initial_level):
+            # Update the objective and the initial level of the model
+            battery.set_objective(prices)
+            battery.update_initial_level(initial_level)
+
+            # Solve the optimization problem and collect output
+            battery.solve_model()
+            return battery.collect_output()
+
+    elif solver == 'greedy':
+        def solve(prices, initial_level):
+            return solve_day(
+                prices,
+                initial_level,
+                max_charge_power_capacity,
+                max_discharge_power_capacity,
+                efficiency,
+                discharge_efficiency,
+                discharge_energy_capacity,
+                min_capacity,
+                max_daily_discharged_throughput,
+            )
+
+    else:
+        raise ValueError("Error: solver must be 'linprog', 'pulp' or 'greedy'")
+
+    return solve
+
+
+# # Parallel simulation
+# Days are only linked by their initial level, which is the final level of the previous day.
+# As a full day of arbitrage usually leaves the battery at its minimum capacity, every day but the first one is first solved assuming it starts at `min_capacity`.
+# These days are independent, so they are solved in parallel: in worker processes with `solve_days`, or, for the merit-order dispatch, with `solve_days_greedy` on Numba's threads.
+# For the merit-order dispatch `workers` is the number of Numba threads, limited to the size of Numba's thread pool (NUMBA_NUM_THREADS); without Numba it runs in a single thread.
+# `simulate_battery` then checks every day in order and solves again, one by one, the days whose actual initial level is different, so the result is the same as solving them in sequence.
+
+
+def solve_days(arguments):
+    # Solve a group of days in a worker process.
+    # `arguments` holds the solver name, the battery parameters of `day_solver`, the prices of each day and their initial levels.
+    solver, battery_parameters, prices_of_days, initial_levels = arguments
+    solve = day_solver(solver, **battery_parameters)
+
+    hourly_charges = np.empty((len(prices_of_days), battery_parameters['time_horizon']))
+    hourly_discharges = np.empty((len(prices_of_days), battery_parameters['time_horizon']))
+    for day, (prices, initial_level) in enumerate(zip(prices_of_days, initial_levels)):
+        hourly_charges[day], hourly_discharges[day] = solve(prices, initial_level)
+
+    return hourly_charges, hourly_discharges
+
+
+@njit(parallel=True, cache=True)
+def solve_days_greedy(
+        prices_of_days,
+        initial_levels,
+        max_charge_power_capacity,
+        max_discharge_power_capacity,
+        efficiency,
+        discharge_efficiency,
+        discharge_energy_capacity,
+        min_capacity,
+        max_daily_discharged_throughput,
+):
+    # Merit-order dispatch of many days at once, one row of `prices_of_days` per day
+    n_days, time_horizon = prices_of_days.shape
+    hourly_charges = np.empty((n_days, time_horizon))
+    hourly_discharges = np.empty((n_days, time_horizon))
+
+    for day in prange(n_days):
+        hourly_charges[day], hourly_discharges[day] = solve_day(
+            prices_of_days[day],
+            initial_levels[day],
+            max_charge_power_capacity,
+            max_discharge_power_capacity,
+            efficiency,
+            discharge_efficiency,
+            discharge_energy_capacity,
+            min_capacity,
+            max_daily_discharged_throughput,
+        )
+
+    return hourly_charges, hourly_discharges
+
+
 # # Run the simulation
 # In this section, we'll define a function, `simulate_battery`, that simulates the operation of the battery for energy arbitrage over the course of a year. 
 # Here are the inputs to the function:
@@ -182,7 +573,8 @@ class Battery():
 # - `efficiency`, the AC-AC Round-trip efficiency, (unitless)
 # - `max_daily_discharged_throughput`, (MWh)
 # - `time_horizon`, the optimization time horizon (h), assumed here to be greater than or equal to 24.
-# - `start_day`, a pandas `Timestamp` for noon on the first simulation day
+# - `solver`, `'linprog'` to solve the linear programming model every day with `scipy.optimize.linprog` (`build_lp`), `'pulp'` to solve it with the `Battery` class, or `'greedy'` for the faster merit-order dispatch (`solve_day`), a heuristic whose profit is usually lower than the optimum
+# - `workers`, the number of processes used to solve the days in parallel (Numba threads for `'greedy'`), `None` for one per CPU core. With 1 the days are solved in sequence
 #
 # The function returns several outputs that can be used to examine system operation:
 #
@@ -200,24 +592,101 @@ def simulate_battery(
         discharge_efficiency,
         max_daily_discharged_throughput,
         time_horizon,
-        start_day,
         min_capacity,
+        solver='linprog',
+        workers=1,
         ):
     # Track simulation time
     tic = time.time()
 
-    # Initialize output variables
-    all_hourly_charges = np.empty(0)
-    all_hourly_discharges = np.empty(0)
-    all_hourly_state_of_energy = np.empty(0)
-    all_daily_discharge_throughput = np.empty(0)
+    # Prices of the whole simulation, so each day is just a slice of the array
+    prices_all = np.ascontiguousarray(price_data['value'].to_numpy(dtype=np.float64))
 
-    # Set up decision variables for optimization by instantiating the Battery class
-    battery = Battery(
+    # Number of days that can be simulated with the price data, as every day needs a full time horizon of prices
+    n_days = (len(price_data) - time_horizon) // 24 + 1
+
+    # The outputs are allocated for 24 hours per day and every slot must be written by the day loop, so reject up front any input that would leave slots empty:
+    # - every day stores 24 hours of operation, so the time horizon cannot be shorter than a day
+    # - there must be enough prices for at least one full time horizon
+    if time_horizon < 24:
+        raise ValueError('Error: the time horizon must be at least 24 hours, got {}'.format(time_horizon))
+    if n_days < 1:
+        raise ValueError(
+            'Error: need at least one time horizon of prices ({} hours), but the price data has {}'.format(time_horizon, len(price_data))
+        )
+
+    # The merit-order dispatch only moves the state of energy within the storage limits, so it cannot bring back an initial level that is outside them.
+    # It is checked once here: the following days start where the previous one ended, always within the limits.
+    # The linear programming solvers report this case themselves.
+    if solver == 'greedy' and not min_capacity <= initial_level <= discharge_energy_capacity:
+        raise ValueError(
+            'Error: the merit-order dispatch could not solve the day with initial level {} MWh: '
+            'it must be between the minimum capacity ({} MWh) and the discharge energy capacity ({} MWh)'.format(
+                initial_level, min_capacity, discharge_energy_capacity,
+            )
+        )
+
+    # Initialize output variables
+    # They are allocated once with their final size and filled in day by day
+    # Single precision is enough for the results, the solvers and the initial level of each day still work in double precision
+    all_hourly_charges = np.empty(n_days * 24, dtype=np.float32)
+    all_hourly_discharges = np.empty(n_days * 24, dtype=np.float32)
+    all_hourly_state_of_energy = np.empty(n_days * 24, dtype=np.float32)
+    all_daily_discharge_throughput = np.empty(n_days, dtype=np.float32)
+
+    battery_parameters = dict(
         time_horizon=time_horizon,
         max_discharge_power_capacity=max_discharge_power_capacity,
         max_charge_power_capacity=max_charge_power_capacity,
+        discharge_energy_capacity=discharge_energy_capacity,
+        efficiency=efficiency,
+        discharge_efficiency=discharge_efficiency,
+        max_daily_discharged_throughput=max_daily_discharged_throughput,
+        min_capacity=min_capacity,
     )
+    solve = day_solver(solver, **battery_parameters)
+
+    #############################################
+    # Solve the days in parallel, assuming their initial level
+    #############################################
+
+    if workers is None:
+        workers = os.cpu_count()
+
+    if workers > 1:
+        guessed_levels = np.full(n_days, float(min_capacity))
+        guessed_levels[0] = initial_level
+        prices_of_days = np.stack(
+            [prices_all[24 * day_count: 24 * day_count + time_horizon] for day_count in range(n_days)]
+        )
+
+        if solver == 'greedy':
+            # The days run on Numba's threads, so `workers` sets how many of them are used during this call
+            previous_threads = get_num_threads()
+            set_num_threads(min(workers, numba_config.NUMBA_NUM_THREADS))
+            try:
+                guessed_charges, guessed_discharges = solve_days_greedy(
+                    prices_of_days,
+                    guessed_levels,
+                    max_charge_power_capacity,
+                    max_discharge_power_capacity,
+                    efficiency,
+                    discharge_efficiency,
+                    discharge_energy_capacity,
+                    min_capacity,
+                    max_daily_discharged_throughput,
+                )
+            finally:
+                set_num_threads(previous_threads)
+        else:
+            groups = np.array_split(np.arange(n_days), workers)
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(
+                    solve_days,
+                    [(solver, battery_parameters, prices_of_days[group], guessed_levels[group]) for group in groups],
+                ))
+            guessed_charges = np.concatenate([charges for charges, _ in results])
+            guessed_discharges = np.concatenate([discharges for _, discharges in results])
 
     #############################################
     # Run the optimization for each day of the year.
@@ -225,66 +694,45 @@ def simulate_battery(
 
     # There are 365 24-hour periods (noon to noon) in the simulation, contained within 366 days
 
-    for day_count in range(1):  # Set to sim length 
+    for day_count in range(n_days):
         print('Trying cycle {}'.format(day_count))
 
         #############################################
         # Select data and simulate daily operation
         #############################################
 
-        # Retrieve the price data that will be used to calculate the objective
-        data_for_this_day = price_data.loc[24 * day_count: 24 * day_count + time_horizon - 1]
-        prices = data_for_this_day['value'].values
+        if workers > 1 and abs(guessed_levels[day_count] - initial_level) <= 1e-9:
+            # The day was already solved in parallel with the right initial level
+            hourly_charges = guessed_charges[day_count]
+            hourly_discharges = guessed_discharges[day_count]
+        else:
+            # Retrieve the price data that will be used to calculate the objective
+            prices = prices_all[24 * day_count: 24 * day_count + time_horizon]
 
-        # Create model and objective
-        battery.set_objective(prices)
+            # Solve the optimization problem and collect output
+            hourly_charges, hourly_discharges = solve(prices, initial_level)
 
-        # Set storage constraints
-        battery.add_storage_constraints(
-            efficiency=efficiency,
-            min_capacity=min_capacity,
-            discharge_energy_capacity=discharge_energy_capacity,
-            discharge_efficiency=discharge_efficiency,
-            initial_level=initial_level,
-        )
-
-        # Set maximum discharge throughput constraint
-        battery.add_throughput_constraints(max_daily_discharged_throughput)
-
-        # Solve the optimization problem and collect output
-        battery.solve_model()
-        hourly_charges, hourly_discharges = battery.collect_output()
+        # Only the first 24 hours are kept, the rest of the time horizon is optimized again the next day
+        hourly_charges = hourly_charges[:24]
+        hourly_discharges = hourly_discharges[:24]
 
         #############################################
         # Manipulate daily output for data analysis
         #############################################
 
-        # Collect daily discharge throughput
-        daily_discharge_throughput = sum(hourly_discharges)
-        # Calculate net hourly power flow (kW), needed for state of energy.
-        # Tanto la carga como la descarga han de tener en cuenta el rendimiento, debido a que no toda la energía estará disponible.
-        net_hourly_activity = (hourly_charges * efficiency) - (hourly_discharges*discharge_efficiency)
-        # Cumulative changes in energy over time (kWh) from some baseline
-        cumulative_hourly_activity = np.cumsum(net_hourly_activity)
-        # Add the baseline for hourly state of energy during the next time step (t2)
-        
-        state_of_energy_from_t2 = initial_level + cumulative_hourly_activity
-
-        # Append output
-    
-        all_hourly_charges = np.append(all_hourly_charges, hourly_charges)
-        all_hourly_discharges = np.append(
-            all_hourly_discharges,
+        # Store the hourly output and the state of energy, and collect daily discharge throughput
+        final_level, daily_discharge_throughput = postprocess(
+            hourly_charges,
             hourly_discharges,
-        )
-        all_hourly_state_of_energy = np.append(
+            efficiency,
+            discharge_efficiency,
+            initial_level,
             all_hourly_state_of_energy,
-            state_of_energy_from_t2,
-        )
-        all_daily_discharge_throughput = np.append(
-            all_daily_discharge_throughput,
-            daily_discharge_throughput,
+            all_hourly_charges,
+            all_hourly_discharges,
+            24 * day_count,
         )
+        all_daily_discharge_throughput[day_count] = daily_discharge_throughput
 
         #############################################
         # Set up the next day
@@ -292,7 +740,7 @@ def simulate_battery(
 
         # El nivel inicial del siguiente periodo es el punto final del del periodo actual 
 
-        initial_level = state_of_energy_from_t2[-1]
+        initial_level = final_level
 
     toc = time.time()
 
@@ -1,6 +1,5 @@
 # Código para el almacenaminto
 
-from tkinter import CENTER
 import pandas as pd
 import numpy as np
 import codigo_tfm_prog_objetos as tfm
@@ -29,7 +28,6 @@ if __name__ == '__main__':
         discharge_efficiency=0.86, # TODO Cambiar valor según la tecnología a simular
         max_daily_discharged_throughput= 5. * (max_discharge_power_capacity), #MWh # TODO Cambiar valor según la tecnología a simular
         time_horizon=24, #Horas
-        start_day=None,
         min_capacity=(dod_batery*max_discharge_power_capacity)*5, #MWh # TODO Cambiar valor según la tecnología a simular
         )
 )
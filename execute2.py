@@ -1,9 +1,7 @@
-from ctypes.wintypes import PINT
-from json import load
-from re import X
-from tkinter import CENTER
 import pandas as pd
 import matplotlib as mpl
+# Las gráficas se guardan en ficheros, sin abrir ventanas, así que no hace falta un backend interactivo
+mpl.use('Agg')
 import matplotlib.pyplot as plt
 import numpy as np
 
@@ -18,22 +16,37 @@ all_hourly_discharges = np.load('apoyo_sim_2.npy',allow_pickle=True)
 all_hourly_state_of_energy = np.load('apoyo_sim_3.npy',allow_pickle=True)
 all_daily_discharge_throughput = np.load('apoyo_sim_4.npy',allow_pickle=True)
 
-tabla=pd.read_csv('data_pmd\export_PrecioMedioHorarioComponenteMercadoDiario _2022.csv', sep=';')
-all_data_sim_time = pd.DataFrame(data=tabla)
-all_data_sim_time.index = pd.DatetimeIndex(pd.to_datetime(all_data_sim_time['datetime'], format='%Y/%m/%d %H:%M'))
-all_data_sim_time = all_data_sim_time.iloc[: , 1:]
+# Se leen todas las columnas menos 'id', y las fechas (formato ISO, 2021-07-01T00:00:00) se usan como índice del dataframe
+all_data_sim_time = pd.read_csv(
+    'data_pmd\export_PrecioMedioHorarioComponenteMercadoDiario _2022.csv',
+    sep=';',
+    usecols=lambda column: column != 'id',
+)
+all_data_sim_time.index = pd.to_datetime(all_data_sim_time['datetime'], format='ISO8601')
+if not isinstance(all_data_sim_time.index, pd.DatetimeIndex):
+    raise ValueError('Error: the datetime column could not be read as dates')
 #print(all_data_sim_time.head())
 #print(all_data_sim_time.tail())
 
-#These indicate flows during the hour of the datetime index
-all_data_sim_time['Charging power (kW)'] = all_hourly_charges
-all_data_sim_time['Discharging power (kW)'] = all_hourly_discharges
-all_data_sim_time['Power output (kW)'] =  all_hourly_discharges - all_hourly_charges
+# Los resultados se calculan con los arrays de la simulación y se añaden al dataframe de una sola vez
+precio = all_data_sim_time['value'].to_numpy()
+revenue = all_hourly_discharges * precio
+charging_cost = all_hourly_charges * precio
 #This is the state of power at the beginning of the hour of the datetime index 
-all_data_sim_time['State of Energy (kWh)'] = np.append(initial_level, all_hourly_state_of_energy[0:-1])
-all_data_sim_time['Revenue generation (€)'] = all_data_sim_time['Discharging power (kW)'] * all_data_sim_time['value']
-all_data_sim_time['Charging cost (€)'] = all_data_sim_time['Charging power (kW)']* all_data_sim_time['value']
-all_data_sim_time['Profit (€)'] = all_data_sim_time['Revenue generation (€)']- all_data_sim_time['Charging cost (€)']
+state_of_energy = np.empty_like(all_hourly_state_of_energy)
+state_of_energy[0] = initial_level
+state_of_energy[1:] = all_hourly_state_of_energy[:-1]
+
+all_data_sim_time = all_data_sim_time.assign(**{
+    #These indicate flows during the hour of the datetime index
+    'Charging power (kW)': all_hourly_charges,
+    'Discharging power (kW)': all_hourly_discharges,
+    'Power output (kW)': all_hourly_discharges - all_hourly_charges,
+    'State of Energy (kWh)': state_of_energy,
+    'Revenue generation (€)': revenue,
+    'Charging cost (€)': charging_cost,
+    'Profit (€)': revenue - charging_cost,
+})
 all_data_sim_time['Revenue generation (€)'].sum()
 
 # Resultados y comprobaciones
@@ -49,7 +62,7 @@ pm_min = np.min(all_data_sim_time['value'])
 pm_max = np.max(all_data_sim_time['value'])
 print(f'Precio Marginal Máximo (€/MWh): {pm_max}')
 print(f'Precio Marginal Mínimo (€/MWh): {pm_min}')
-e_descargada=sum(all_daily_discharge_throughput)
+e_descargada=all_daily_discharge_throughput.sum()
 print(f'Energía total descargada en un año: {e_descargada} (MWh)')
 
 # Guardamos el dataframe de resultados para trabajar con ellos en Excel:
@@ -67,21 +80,25 @@ plt.hist(all_hourly_discharges - all_hourly_charges)
 plt.title('Hourly power output')
 plt.ylabel('Nº de Horas')
 plt.xlabel('MW')
-plt.show()
+plt.savefig('fig_hourly_power_output.png', dpi=100)
+plt.close()
 
 #plt.hist(all_hourly_state_of_energy)
 #plt.xlabel('MWh')
 #plt.title('Hourly state of energy')
-#plt.show()
+#plt.savefig('fig_hourly_state_of_energy.png', dpi=100)
+#plt.close()
 
 #all_data_sim_time['Profit (€)'].resample('M').sum().plot()
 #plt.title('Beneficio mensual (€)')
 #plt.xlabel('Mes')
 #plt.ylabel('Beneficio (€)')
-#plt.show()
+#plt.savefig('fig_beneficio_mensual.png', dpi=100)
+#plt.close()
 
 #all_data_sim_time['value'].resample('Y').plot()
 #plt.title('Precio marginal horario (€/MWh)')
 #plt.ylabel('Precio marginal (€/MWh)')
 #plt.xlabel('Mes')
-#plt.show()
+#plt.savefig('fig_precio_marginal.png', dpi=100)
+#plt.close()